@@ -1,9 +1,20 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, make_response, g, has_app_context
+from flask.json.provider import DefaultJSONProvider
+from flask_caching import Cache
+import functools
 import json
 import os
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
 from supabase import create_client, Client
-from email_service import send_alert_email, send_change_of_plans_email
+from postgrest.utils import SyncClient
+import httpx
+from cachetools import TTLCache
+from apscheduler.schedulers.background import BackgroundScheduler
+from email_service import send_alert_email, send_change_of_plans_email, queue_email, start_email_worker, prepare_email_config
+import orjson
 import pytz
 
 # Load .env file for local development
@@ -13,7 +24,48 @@ try:
 except ImportError:
     pass
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes responses and parses request bodies with orjson
+    (same sorted-key output as the default).
+    """
+    
+    # Sort keys like Flask does, and hand dates/datetimes to self.default so they're
+    # formatted the same way too (orjson would otherwise write them as ISO 8601)
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.ORJSON_OPTIONS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self.ORJSON_OPTIONS),
+            mimetype=self.mimetype
+        )
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# In-process response cache for the read-heavy GET endpoints
+cache = Cache(app, config={"CACHE_TYPE": "SimpleCache"})
+RESPONSE_CACHE_TIMEOUT = 60
+
+def etag_cached(view):
+    """Let browsers revalidate a GET endpoint with a weak ETag instead of re-downloading it.
+    Unchanged responses are answered with an empty 304.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            response.cache_control.no_cache = True
+            response.add_etag(weak=True)
+            response.make_conditional(request)
+        return response
+    return wrapper
 
 CONFIG_PATH = "config.json"
 
@@ -23,58 +75,183 @@ supabase: Client = create_client(
     os.environ.get("SUPABASE_KEY", "")
 )
 
+# Connection pool for PostgREST calls, shared by all in-flight requests and query_pool.
+# Idle connections are kept warm for 30s so requests skip the TCP + TLS handshake.
+SUPABASE_POOL_LIMITS = httpx.Limits(max_connections=40, max_keepalive_connections=20, keepalive_expiry=30)
+SUPABASE_TIMEOUT = 10
+
+def configure_supabase_pool(client):
+    """Replace the PostgREST HTTP session with a keep-alive HTTP/2 session using SUPABASE_POOL_LIMITS."""
+    old_session = client.postgrest.session
+    client.postgrest.session = SyncClient(
+        base_url=old_session.base_url,
+        headers=old_session.headers,
+        timeout=SUPABASE_TIMEOUT,
+        follow_redirects=True,
+        http2=True,
+        limits=SUPABASE_POOL_LIMITS
+    )
+    old_session.close()
+
+configure_supabase_pool(supabase)
+
+# Thread pool for running independent Supabase queries at the same time
+query_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="supabase-query")
+
+# Looked up once - pytz timezone objects handle DST themselves
+SYDNEY_TZ = pytz.timezone('Australia/Sydney')
+
 def get_sydney_timezone():
     """Get current Sydney timezone (handles DST automatically)."""
-    return pytz.timezone('Australia/Sydney')
+    return SYDNEY_TZ
 
 def get_sydney_now():
     """Get current datetime in Sydney timezone."""
-    sydney_tz = get_sydney_timezone()
-    return datetime.now(sydney_tz)
+    return datetime.now(SYDNEY_TZ)
 
 def get_sydney_today():
-    """Get today's date in Sydney timezone."""
-    return get_sydney_now().date()
-
-def load_config():
-    """Load config from JSON file, override email settings with env vars if present."""
-    with open(CONFIG_PATH, "r") as f:
-        config = json.load(f)
+    """Get today's date in Sydney timezone, worked out at most once per request."""
+    if not has_app_context():
+        return get_sydney_now().date()
     
+    if "sydney_today" not in g:
+        g.sydney_today = get_sydney_now().date()
+    return g.sydney_today
+
+def get_email_env_overrides():
+    """Collect email settings from env vars (only the ones that are set)."""
+    overrides = {}
     if os.environ.get("SMTP_HOST"):
-        config["email"]["smtp_host"] = os.environ.get("SMTP_HOST")
+        overrides["smtp_host"] = os.environ.get("SMTP_HOST")
     if os.environ.get("SMTP_PORT"):
-        config["email"]["smtp_port"] = int(os.environ.get("SMTP_PORT"))
+        overrides["smtp_port"] = int(os.environ.get("SMTP_PORT"))
     if os.environ.get("SMTP_USER"):
-        config["email"]["smtp_user"] = os.environ.get("SMTP_USER")
+        overrides["smtp_user"] = os.environ.get("SMTP_USER")
     if os.environ.get("SMTP_PASSWORD"):
-        config["email"]["smtp_password"] = os.environ.get("SMTP_PASSWORD")
+        overrides["smtp_password"] = os.environ.get("SMTP_PASSWORD")
     if os.environ.get("FROM_EMAIL"):
-        config["email"]["from_email"] = os.environ.get("FROM_EMAIL")
+        overrides["from_email"] = os.environ.get("FROM_EMAIL")
     if os.environ.get("FROM_NAME"):
-        config["email"]["from_name"] = os.environ.get("FROM_NAME")
-    
-    return config
+        overrides["from_name"] = os.environ.get("FROM_NAME")
+    return overrides
+
+# Env vars don't change while the process runs, so read them once
+EMAIL_ENV_OVERRIDES = get_email_env_overrides()
+
+@functools.lru_cache(maxsize=1)
+def parse_config(mtime_ns):
+    """Parse config.json and apply env overrides. Cached per file mtime, so it only
+    runs again when the file changes on disk.
+    """
+    with open(CONFIG_PATH, "r") as f:
+        config = json.load(f)
+    config["email"].update(EMAIL_ENV_OVERRIDES)
+    return prepare_email_config(config)
+
+def read_config():
+    """Read config from JSON file, override email settings with env vars if present."""
+    return parse_config(os.stat(CONFIG_PATH).st_mtime_ns)
+
+def load_config():
+    """Get the config, reading it at most once per request."""
+    if not has_app_context():
+        return read_config()
+    
+    if "config" not in g:
+        g.config = read_config()
+    return g.config
+
+def run_in_parallel(*funcs):
+    """Run independent functions (usually Supabase queries) concurrently, return their results in order."""
+    futures = [query_pool.submit(func) for func in funcs]
+    return [future.result() for future in futures]
+
+# Max rows per bulk write, so request bodies stay a sensible size for PostgREST
+BULK_BATCH_SIZE = 500
+# Max values per in_() filter - these go in the URL, which has a much lower size limit
+IN_FILTER_BATCH_SIZE = 100
+
+def chunked(items, size=BULK_BATCH_SIZE):
+    """Split a list into consecutive chunks of at most size items."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def in_filter_batches(values):
+    """De-duplicate values (keeping order) and split them into batches small enough for an in_() filter."""
+    return chunked(list(dict.fromkeys(values)), IN_FILTER_BATCH_SIZE)
+
+def invalidate_response_cache():
+    """Drop cached responses after absences or key holders change."""
+    cache.delete_many("absences", "weekly_status")
+
+# The employees table rarely changes, so keep it in memory for a short time.
+# toggle-key clears it straight away; other edits show up within EMPLOYEES_CACHE_TTL seconds.
+EMPLOYEES_CACHE_TTL = 30
+_employees_cache = TTLCache(maxsize=1, ttl=EMPLOYEES_CACHE_TTL)
+_employees_cache_lock = threading.Lock()
+
+def invalidate_employees_cache():
+    """Drop the cached employees list after an employee is changed."""
+    with _employees_cache_lock:
+        _employees_cache.clear()
 
 def get_key_bearers():
     """Get all employees who have office keys."""
-    result = supabase.table("employees").select("*").eq("has_key", True).execute()
-    return result.data if result.data else []
+    return [e for e in get_all_employees() if e.get("has_key")]
+
+def employee_has_key(employee_name):
+    """Check whether an employee has an office key, using the cached employees list."""
+    return any(e["name"] == employee_name and e.get("has_key") for e in get_all_employees())
 
 def get_all_employees():
-    """Get all employees."""
+    """Get all employees (cached for EMPLOYEES_CACHE_TTL seconds). Don't modify the returned list."""
+    with _employees_cache_lock:
+        employees = _employees_cache.get("employees")
+    if employees is not None:
+        return employees
+    
     result = supabase.table("employees").select("*").order("name").execute()
-    return result.data if result.data else []
+    employees = result.data if result.data else []
+    
+    with _employees_cache_lock:
+        _employees_cache["employees"] = employees
+    return employees
+
+# Lookup tables indexed by date.weekday() / date.month, used instead of strftime
+WEEKDAY_NAMES = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+DAY_ABBRS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTH_ABBRS = ("", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
 
 def get_weekday_name(d):
     """Get lowercase weekday name from date."""
-    return d.strftime("%A").lower()
+    return WEEKDAY_NAMES[d.weekday()]
 
 def get_week_dates(start_date):
     """Get Monday-Friday dates for the week containing start_date."""
     monday = start_date - timedelta(days=start_date.weekday())
     return [monday + timedelta(days=i) for i in range(5)]
 
+def get_weekdays_between(start_date, end_date):
+    """Get all Monday-Friday dates from start_date to end_date (inclusive), skipping weekends without visiting them."""
+    current = start_date
+    if current.weekday() > 4:
+        current += timedelta(days=7 - current.weekday())
+    
+    dates = []
+    while current <= end_date:
+        dates.append(current)
+        # Friday jumps straight to Monday
+        current += timedelta(days=3 if current.weekday() == 4 else 1)
+    return dates
+
+def get_dates_for_weekday(weekday_name, start_date, end_date):
+    """Get every date that falls on weekday_name (e.g. 'monday') from start_date to end_date (inclusive)."""
+    if weekday_name not in WEEKDAY_NAMES:
+        return []
+    
+    # Step straight to the first matching date, then a week at a time
+    first = start_date + timedelta(days=(WEEKDAY_NAMES.index(weekday_name) - start_date.weekday()) % 7)
+    return [first + timedelta(weeks=i) for i in range((end_date - first).days // 7 + 1)]
+
 def get_two_week_dates():
     """Get dates for current week and next week (Mon-Fri each)."""
     today = get_sydney_today()
@@ -83,8 +260,11 @@ def get_two_week_dates():
     return current_week + next_week
 
 def run_monthly_sync():
-    """Run monthly sync operations - populate next month on 25th, cleanup last month on 5th."""
+    """Run monthly sync operations - populate next month on 25th, cleanup last month on 5th.
+    Called once a day by the scheduler (see start_scheduler).
+    """
     today = get_sydney_today()
+    
     current_month = today.month
     current_year = today.year
     
@@ -94,10 +274,8 @@ def run_monthly_sync():
         next_year = current_year if current_month < 12 else current_year + 1
         sync_key = f"populate_{next_year}_{next_month}"
         
-        existing = supabase.table("sync_log").select("id").eq("sync_key", sync_key).execute()
-        if not existing.data:
-            populate_month_absences(next_year, next_month)
-            supabase.table("sync_log").insert({"sync_key": sync_key}).execute()
+        if claim_sync(sync_key):
+            run_claimed_sync(sync_key, populate_month_absences, next_year, next_month)
     
     # On 5th or later: cleanup last month's absences
     if today.day >= 5:
@@ -105,14 +283,31 @@ def run_monthly_sync():
         last_year = current_year if current_month > 1 else current_year - 1
         sync_key = f"cleanup_{last_year}_{last_month}"
         
-        existing = supabase.table("sync_log").select("id").eq("sync_key", sync_key).execute()
-        if not existing.data:
-            cleanup_month_absences(last_year, last_month)
-            supabase.table("sync_log").insert({"sync_key": sync_key}).execute()
+        if claim_sync(sync_key):
+            run_claimed_sync(sync_key, cleanup_month_absences, last_year, last_month)
+
+def claim_sync(sync_key):
+    """Record a sync operation in sync_log, unless it's already there.
+    Returns True only for the caller whose insert took effect, so concurrent workers can't both run it.
+    """
+    result = supabase.table("sync_log").upsert(
+        {"sync_key": sync_key}, on_conflict="sync_key", ignore_duplicates=True
+    ).execute()
+    return bool(result.data)
+
+def run_claimed_sync(sync_key, sync_func, year, month):
+    """Run a claimed sync operation, releasing the claim if it fails so it's retried on the next run."""
+    try:
+        sync_func(year, month)
+    except Exception as e:
+        print(f"Error running {sync_key}: {e}")
+        supabase.table("sync_log").delete().eq("sync_key", sync_key).execute()
+        return
+    invalidate_response_cache()
 
 def populate_month_absences(year, month):
     """Populate absences for a month based on usual absence patterns."""
-    usual = supabase.table("usual_absences").select("*").execute()
+    usual = supabase.table("usual_absences").select("employee_name, monday, tuesday, wednesday, thursday, friday").execute()
     
     if not usual.data:
         return
@@ -123,24 +318,27 @@ def populate_month_absences(year, month):
     else:
         last_day = date(year, month + 1, 1) - timedelta(days=1)
     
+    # Employees usually absent on each weekday, so each date only looks at its own list
+    by_weekday = {
+        weekday: [p["employee_name"] for p in usual.data if p.get(weekday, False)]
+        for weekday in WEEKDAY_NAMES[:5]
+    }
+    
     entries = []
-    current = first_day
-    while current <= last_day:
-        weekday = get_weekday_name(current)
-        if weekday in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']:
-            for pattern in usual.data:
-                if pattern.get(weekday, False):
-                    entries.append({
-                        "employee_name": pattern["employee_name"],
-                        "absence_date": current.isoformat()
-                    })
-        current += timedelta(days=1)
-    
-    for entry in entries:
-        try:
-            supabase.table("absences").upsert(entry, on_conflict="employee_name,absence_date").execute()
-        except:
-            pass
+    for current in get_weekdays_between(first_day, last_day):
+        names = by_weekday[get_weekday_name(current)]
+        if not names:
+            continue
+        d_str = current.isoformat()
+        entries.extend({"employee_name": name, "absence_date": d_str} for name in names)
+    
+    if not entries:
+        return
+    
+    # Upsert the whole month in as few requests as possible (one, unless it's a big team).
+    # Errors are left to run_claimed_sync, which releases the claim so the month is retried.
+    for batch in chunked(entries):
+        supabase.table("absences").upsert(batch, on_conflict="employee_name,absence_date").execute()
 
 def cleanup_month_absences(year, month):
     """Remove all absences from a past month."""
@@ -152,59 +350,101 @@ def cleanup_month_absences(year, month):
     
     supabase.table("absences").delete().gte("absence_date", first_day.isoformat()).lte("absence_date", last_day.isoformat()).execute()
 
-def can_send_new_alert(target_date):
-    """Check if we can send a new alert for this date.
-    Returns True if:
+def get_followup_pending_dates(dates):
+    """Get the set of dates that had an alert sent but no follow-up yet, using a single query
+    (one per IN_FILTER_BATCH_SIZE dates).
+    """
+    pending = set()
+    for batch in in_filter_batches(dates):
+        existing = supabase.table("email_log").select("alert_date, followup_sent").in_("alert_date", batch).execute()
+        pending.update(row["alert_date"] for row in existing.data if not row.get("followup_sent", False))
+    return pending
+
+def claim_followups(dates):
+    """Mark the follow-up as sent for dates that had an alert sent but no follow-up yet.
+    Only rows still at followup_sent=False are updated, so if two requests race for the same
+    date only one of them gets it back. Returns the claimed dates, in order.
+    """
+    claimed = set()
+    for batch in in_filter_batches(dates):
+        result = supabase.table("email_log").update({"followup_sent": True}).in_("alert_date", batch).eq("followup_sent", False).execute()
+        claimed.update(row["alert_date"] for row in result.data)
+    return [d for d in dict.fromkeys(dates) if d in claimed]
+
+def get_alertable_dates(dates):
+    """Get the dates (in order, without duplicates) for which a new alert can be sent,
+    using a single email_log query. A new alert can be sent if:
     - No email_log entry exists, OR
     - Email_log entry exists AND followup_sent=True (someone became available, so cycle reset)
     """
-    existing = supabase.table("email_log").select("*").eq("alert_date", target_date).execute()
-    
-    if not existing.data:
-        return True
-    
-    # If followup was sent, we can send a new alert
-    return existing.data[0].get("followup_sent", False)
+    blocked = get_followup_pending_dates(dates)
+    return [d for d in dict.fromkeys(dates) if d not in blocked]
 
-def check_and_send_alert(target_date):
-    """Check if all key bearers are absent and send alert if needed."""
-    config = load_config()
-    key_bearers = get_key_bearers()
-    
-    if not key_bearers:
-        return {"sent": False, "reason": "no_key_bearers"}
-    
-    # Check if we can send a new alert
-    if not can_send_new_alert(target_date):
-        return {"sent": False, "reason": "already_sent"}
-    
-    absences = supabase.table("absences").select("employee_name").eq("absence_date", target_date).execute()
-    
-    absent_names = {row["employee_name"] for row in absences.data}
-    all_bearer_names = {kb["name"] for kb in key_bearers}
-    
-    if absent_names >= all_bearer_names:
-        # success = send_alert_email(config, target_date, key_bearers)
-        success = True  # --- IGNORE ---
-        
-        if success:
-            # Delete old entry if exists, then insert fresh one
-            supabase.table("email_log").delete().eq("alert_date", target_date).execute()
-            supabase.table("email_log").insert({"alert_date": target_date, "followup_sent": False}).execute()
-            return {"sent": True, "reason": "all_absent"}
-        else:
-            return {"sent": False, "reason": "email_failed"}
-    
-    return {"sent": False, "reason": "not_all_absent", "absent": len(absent_names & all_bearer_names), "total": len(all_bearer_names)}
+def get_absent_names_by_date(dates, names=None):
+    """Get the set of absent employee names for each date, using a single query
+    (one per IN_FILTER_BATCH_SIZE dates).
+    If names is given, only absences of those employees are fetched.
+    """
+    absent_by_date = defaultdict(set)
+    for batch in in_filter_batches(dates):
+        query = supabase.table("absences").select("employee_name, absence_date").in_("absence_date", batch)
+        if names is not None:
+            query = query.in_("employee_name", list(names))
+        result = query.execute()
+
+        for row in result.data:
+            absent_by_date[row["absence_date"]].add(row["employee_name"])
+    return absent_by_date
+
+def get_absences_in_range(from_date, to_date):
+    """Get the set of absent employee names per date between from_date and to_date (inclusive).
+    The grouping is done by the absences_by_date database function (see supabase_setup.sql).
+    """
+    result = supabase.rpc("absences_by_date", {"from_date": from_date, "to_date": to_date}).execute()
+    return {row["absence_date"]: set(row["employee_names"]) for row in result.data}
+
+def check_and_send_alerts(dates, config):
+    """Check several dates at once and send an alert for each date where all key bearers are absent.
+    The check is done by the check_alert_state database function (see supabase_setup.sql) in one request.
+    Returns the list of dates an alert was sent for.
+    """
+    if not dates:
+        return []
+
+    state = supabase.rpc("check_alert_state", {"dates": list(dict.fromkeys(dates))}).execute().data
+    key_bearers = state["key_bearers"]
+    alerts_sent = state["alert_dates"]
+    if not alerts_sent:
+        return []
+
+    # Log the alerts before they're sent so a date can't be alerted twice while its
+    # email is queued - the worker calls release_alert() if sending fails.
+    # Upsert so an old entry (with followup_sent=True) is reset in the same request
+    supabase.table("email_log").upsert([
+        {"alert_date": d, "followup_sent": False} for d in alerts_sent
+    ], on_conflict="alert_date").execute()
+
+    # for d in alerts_sent:
+    #     queue_email(send_alert_email, config, d, key_bearers, on_failure=release_alert)
+
+    return alerts_sent
+
+def release_alert(alert_date):
+    """Remove the email_log entry of an alert that failed to send, so it can be sent again."""
+    supabase.table("email_log").delete().eq("alert_date", alert_date).eq("followup_sent", False).execute()
+
+def release_followup(alert_date):
+    """Reset followup_sent for a change of plans email that failed to send."""
+    supabase.table("email_log").update({"followup_sent": False}).eq("alert_date", alert_date).execute()
 
 @app.route("/")
 def index():
-    run_monthly_sync()
     employees = get_all_employees()
     sydney_today = get_sydney_today().isoformat()
     return render_template("index.html", employees=employees, sydney_today=sydney_today)
 
 @app.route("/api/employees")
+@etag_cached
 def api_get_employees():
     """Get all employees."""
     employees = get_all_employees()
@@ -217,6 +457,8 @@ def toggle_key_status(employee_name):
     new_status = data.get("has_key", False)
     
     supabase.table("employees").update({"has_key": new_status}).eq("name", employee_name).execute()
+    invalidate_employees_cache()
+    invalidate_response_cache()
     
     return jsonify({"success": True, "has_key": new_status})
 
@@ -224,28 +466,31 @@ def toggle_key_status(employee_name):
 def mark_absent():
     data = request.json
     employee_name = data.get("employee_name")
-    dates = data.get("dates", [])
+    # Drop repeated dates (keeping order) - Postgres rejects an upsert that hits the same row twice
+    dates = list(dict.fromkeys(data.get("dates", [])))
     confirmed = data.get("confirmed", False)
     
     if not employee_name or not dates:
         return jsonify({"error": "Missing employee_name or dates"}), 400
     
+    config = load_config()
     alerts_sent = []
-    
-    for d in dates:
+
+    # Upsert all dates in a single request
+    rows = [{"employee_name": employee_name, "absence_date": d} for d in dates]
+    try:
+        supabase.table("absences").upsert(rows, on_conflict="employee_name,absence_date").execute()
+    except Exception as e:
+        print(f"Error marking absence: {e}")
+        return jsonify({"error": "Failed to mark absence"}), 500
+    invalidate_response_cache()
+
+    if confirmed:
         try:
-            supabase.table("absences").upsert({
-                "employee_name": employee_name,
-                "absence_date": d
-            }, on_conflict="employee_name,absence_date").execute()
-            
-            if confirmed:
-                alert_result = check_and_send_alert(d)
-                if alert_result["sent"]:
-                    alerts_sent.append(d)
+            alerts_sent = check_and_send_alerts(dates, config)
         except Exception as e:
-            print(f"Error marking absence: {e}")
-    
+            print(f"Error checking alerts: {e}")
+
     return jsonify({
         "success": True,
         "dates_marked": dates,
@@ -259,27 +504,19 @@ def check_absence_impact():
     employee_name = data.get("employee_name")
     dates = data.get("dates", [])
     
-    # Check if this employee has a key
-    employee = supabase.table("employees").select("has_key").eq("name", employee_name).execute()
-    if not employee.data or not employee.data[0].get("has_key"):
-        return jsonify({"will_trigger_email": False, "trigger_dates": []})
-    
+    # The key bearer list also tells us whether this employee has a key
     key_bearers = get_key_bearers()
     all_bearer_names = {kb["name"] for kb in key_bearers}
+    if employee_name not in all_bearer_names:
+        return jsonify({"will_trigger_email": False, "trigger_dates": []})
     
-    will_trigger = []
-    
-    for d in dates:
-        # Check if we can send a new alert for this date
-        if not can_send_new_alert(d):
-            continue
-        
-        absences = supabase.table("absences").select("employee_name").eq("absence_date", d).execute()
-        absent_names = {row["employee_name"] for row in absences.data}
-        absent_names.add(employee_name)
-        
-        if absent_names >= all_bearer_names:
-            will_trigger.append(d)
+    # Only dates we can send a new alert for, fetched alongside the absences for all dates
+    alertable, absent_by_date = run_in_parallel(
+        lambda: get_alertable_dates(dates),
+        lambda: get_absent_names_by_date(dates, all_bearer_names)
+    )
+
+    will_trigger = [d for d in alertable if absent_by_date[d] | {employee_name} >= all_bearer_names]
     
     return jsonify({
         "will_trigger_email": len(will_trigger) > 0,
@@ -294,18 +531,12 @@ def check_removal_impact():
     dates = data.get("dates", [])
     
     # Check if this employee has a key
-    employee = supabase.table("employees").select("has_key").eq("name", employee_name).execute()
-    if not employee.data or not employee.data[0].get("has_key"):
+    if not employee_has_key(employee_name):
         return jsonify({"will_trigger_email": False, "trigger_dates": []})
     
-    will_trigger = []
-    
-    for d in dates:
-        # Check if an alert was sent AND followup not yet sent
-        log_entry = supabase.table("email_log").select("*").eq("alert_date", d).execute()
-        
-        if log_entry.data and not log_entry.data[0].get("followup_sent", False):
-            will_trigger.append(d)
+    # Dates where an alert was sent AND followup not yet sent
+    pending = get_followup_pending_dates(dates)
+    will_trigger = [d for d in dates if d in pending]
     
     return jsonify({
         "will_trigger_email": len(will_trigger) > 0,
@@ -319,13 +550,11 @@ def check_usual_absence_impact():
     employee_name = data.get("employee_name")
     day = data.get("day")  # e.g., 'monday'
     
-    # Check if this employee has a key
-    employee = supabase.table("employees").select("has_key").eq("name", employee_name).execute()
-    if not employee.data or not employee.data[0].get("has_key"):
-        return jsonify({"will_trigger_email": False, "trigger_dates": []})
-    
+    # The key bearer list also tells us whether this employee has a key
     key_bearers = get_key_bearers()
     all_bearer_names = {kb["name"] for kb in key_bearers}
+    if employee_name not in all_bearer_names:
+        return jsonify({"will_trigger_email": False, "trigger_dates": []})
     
     # Get all dates for this weekday from today to end of month
     today = get_sydney_today()
@@ -334,26 +563,15 @@ def check_usual_absence_impact():
     else:
         last_day = date(today.year, today.month + 1, 1) - timedelta(days=1)
     
-    will_trigger = []
-    current = today
-    while current <= last_day:
-        if get_weekday_name(current) == day:
-            d_str = current.isoformat()
-            
-            # Check if we can send a new alert
-            if not can_send_new_alert(d_str):
-                current += timedelta(days=1)
-                continue
-            
-            # Get current absences
-            absences = supabase.table("absences").select("employee_name").eq("absence_date", d_str).execute()
-            absent_names = {row["employee_name"] for row in absences.data}
-            absent_names.add(employee_name)
-            
-            if absent_names >= all_bearer_names:
-                will_trigger.append(d_str)
-        
-        current += timedelta(days=1)
+    day_dates = [d.isoformat() for d in get_dates_for_weekday(day, today, last_day)]
+    
+    # Fetch alert state and absences for all of those dates at once
+    alertable, absent_by_date = run_in_parallel(
+        lambda: get_alertable_dates(day_dates),
+        lambda: get_absent_names_by_date(day_dates, all_bearer_names)
+    )
+    
+    will_trigger = [d for d in alertable if absent_by_date[d] | {employee_name} >= all_bearer_names]
     
     return jsonify({
         "will_trigger_email": len(will_trigger) > 0,
@@ -368,8 +586,7 @@ def check_usual_presence_impact():
     day = data.get("day")  # e.g., 'monday'
     
     # Check if this employee has a key
-    employee = supabase.table("employees").select("has_key").eq("name", employee_name).execute()
-    if not employee.data or not employee.data[0].get("has_key"):
+    if not employee_has_key(employee_name):
         return jsonify({"will_trigger_email": False, "trigger_dates": []})
     
     # Get all dates for this weekday from tomorrow to end of month
@@ -380,18 +597,11 @@ def check_usual_presence_impact():
     else:
         last_day = date(today.year, today.month + 1, 1) - timedelta(days=1)
     
-    will_trigger = []
-    current = tomorrow
-    while current <= last_day:
-        if get_weekday_name(current) == day:
-            d_str = current.isoformat()
-            
-            # Check if an alert was sent AND followup not yet sent
-            log_entry = supabase.table("email_log").select("*").eq("alert_date", d_str).execute()
-            if log_entry.data and not log_entry.data[0].get("followup_sent", False):
-                will_trigger.append(d_str)
-        
-        current += timedelta(days=1)
+    day_dates = [d.isoformat() for d in get_dates_for_weekday(day, tomorrow, last_day)]
+    
+    # Dates where an alert was sent AND followup not yet sent
+    pending = get_followup_pending_dates(day_dates)
+    will_trigger = [d for d in day_dates if d in pending]
     
     return jsonify({
         "will_trigger_email": len(will_trigger) > 0,
@@ -399,19 +609,16 @@ def check_usual_presence_impact():
     })
 
 @app.route("/api/absences")
+@etag_cached
+@cache.cached(timeout=RESPONSE_CACHE_TIMEOUT, key_prefix="absences")
 def get_absences():
     """Get all absences for calendar display."""
     today = get_sydney_today().isoformat()
-    result = supabase.table("absences").select("employee_name, absence_date").gte("absence_date", today).execute()
     
-    absences = {}
-    for row in result.data:
-        d = row["absence_date"]
-        if d not in absences:
-            absences[d] = []
-        absences[d].append(row["employee_name"])
+    # Built as a {date: [names]} object in the database (see absences_calendar in supabase_setup.sql)
+    result = supabase.rpc("absences_calendar", {"from_date": today}).execute()
     
-    return jsonify(absences)
+    return jsonify(result.data or {})
 
 @app.route("/api/my-absences/<employee_name>")
 def get_my_absences(employee_name):
@@ -431,29 +638,30 @@ def cancel_absence():
     config = load_config()
     followup_sent_for = []
     
-    for d in dates:
-        # Delete the absence first
-        supabase.table("absences").delete().eq("employee_name", employee_name).eq("absence_date", d).execute()
+    if dates:
+        def delete_absences():
+            for batch in in_filter_batches(dates):
+                supabase.table("absences").delete().eq("employee_name", employee_name).in_("absence_date", batch).execute()
         
+        # Delete the absences with one request per batch of dates, marking at the same time the
+        # followups as sent for dates that need a "change of plans" email - this allows a new
+        # alert to be sent if all become absent again.
         if confirmed:
-            # Check if we need to send "change of plans" email
-            log_entry = supabase.table("email_log").select("*").eq("alert_date", d).execute()
-            
-            if log_entry.data and not log_entry.data[0].get("followup_sent", False):
-                # success = send_change_of_plans_email(config, d, employee_name)
-                success = True  # --- IGNORE ---
-                
-                if success:
-                    # Mark followup as sent - this allows a new alert to be sent if all become absent again
-                    supabase.table("email_log").update({"followup_sent": True}).eq("alert_date", d).execute()
-                    followup_sent_for.append(d)
+            _, followup_sent_for = run_in_parallel(delete_absences, lambda: claim_followups(dates))
+        else:
+            delete_absences()
+    
+    # The worker calls release_followup() if sending fails.
+    # for d in followup_sent_for:
+    #     queue_email(send_change_of_plans_email, config, d, employee_name, on_failure=release_followup)
     
+    invalidate_response_cache()
     return jsonify({"success": True, "dates_cancelled": dates, "followup_emails_sent": followup_sent_for})
 
 @app.route("/api/usual-absences/<employee_name>")
 def get_usual_absences(employee_name):
     """Get usual absence pattern for an employee."""
-    result = supabase.table("usual_absences").select("*").eq("employee_name", employee_name).execute()
+    result = supabase.table("usual_absences").select("monday, tuesday, wednesday, thursday, friday").eq("employee_name", employee_name).execute()
     
     if result.data:
         pattern = result.data[0]
@@ -501,47 +709,46 @@ def update_usual_absences():
     config = load_config()
     alerts_sent = []
     followup_sent = []
+    absent_dates = []
     
-    current = tomorrow
-    while current <= last_day:
-        weekday = get_weekday_name(current)
-        if weekday in ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']:
-            d_str = current.isoformat()
+    present_dates = []
+    
+    for current in get_weekdays_between(tomorrow, last_day):
+        if pattern.get(get_weekday_name(current), False):
+            absent_dates.append(current.isoformat())
+        else:
+            present_dates.append(current.isoformat())
+    
+    if present_dates:
+        # Days marked as PRESENT - remove any absences in one request, marking at the
+        # same time the followups as sent for those that trigger a "change of plans" email
+        try:
+            def delete_absences():
+                return supabase.table("absences").delete().eq("employee_name", employee_name).in_("absence_date", present_dates).execute()
             
-            if pattern.get(weekday, False):
-                # Day marked as ABSENT - add absence
-                try:
-                    supabase.table("absences").upsert({
-                        "employee_name": employee_name,
-                        "absence_date": d_str
-                    }, on_conflict="employee_name,absence_date").execute()
-                    
-                    # Check if this triggers an email alert
-                    if confirmed:
-                        alert_result = check_and_send_alert(d_str)
-                        if alert_result["sent"]:
-                            alerts_sent.append(d_str)
-                except:
-                    pass
+            if confirmed:
+                _, followup_sent = run_in_parallel(delete_absences, lambda: claim_followups(present_dates))
             else:
-                # Day marked as PRESENT - remove absence if exists
-                try:
-                    supabase.table("absences").delete().eq("employee_name", employee_name).eq("absence_date", d_str).execute()
-                    
-                    # Check if this triggers a "change of plans" email
-                    if confirmed:
-                        log_entry = supabase.table("email_log").select("*").eq("alert_date", d_str).execute()
-                        if log_entry.data and not log_entry.data[0].get("followup_sent", False):
-                            # success = send_change_of_plans_email(config, d_str, employee_name)
-                            success = True  # --- IGNORE ---
-                            if success:
-                                supabase.table("email_log").update({"followup_sent": True}).eq("alert_date", d_str).execute()
-                                followup_sent.append(d_str)
-                except:
-                    pass
-        
-        current += timedelta(days=1)
+                delete_absences()
+            
+            # for d in followup_sent:
+            #     queue_email(send_change_of_plans_email, config, d, employee_name, on_failure=release_followup)
+        except Exception as e:
+            print(f"Error removing usual absences: {e}")
+    
+    if absent_dates:
+        try:
+            supabase.table("absences").upsert([
+                {"employee_name": employee_name, "absence_date": d} for d in absent_dates
+            ], on_conflict="employee_name,absence_date").execute()
+            
+            # Check if this triggers email alerts
+            if confirmed:
+                alerts_sent = check_and_send_alerts(absent_dates, config)
+        except Exception as e:
+            print(f"Error adding usual absences: {e}")
     
+    invalidate_response_cache()
     return jsonify({
         "success": True, 
         "message": "Usual absence pattern updated", 
@@ -550,92 +757,53 @@ def update_usual_absences():
     })
 
 @app.route("/api/weekly-status")
+@etag_cached
+@cache.cached(timeout=RESPONSE_CACHE_TIMEOUT, key_prefix="weekly_status")
 def get_weekly_status():
     """Get 2-week status for all employees."""
-    employees = get_all_employees()
-    key_bearers = get_key_bearers()
-    key_bearer_names = {kb["name"] for kb in key_bearers}
-    
     dates = get_two_week_dates()
     date_strs = [d.isoformat() for d in dates]
     
-    result = supabase.table("absences").select("employee_name, absence_date").in_("absence_date", date_strs).execute()
-    
-    absence_map = {}
-    for row in result.data:
-        d = row["absence_date"]
-        if d not in absence_map:
-            absence_map[d] = set()
-        absence_map[d].add(row["employee_name"])
+    # Employees and absences don't depend on each other, so fetch them at the same time
+    employees, absence_map = run_in_parallel(
+        get_all_employees,
+        lambda: get_absences_in_range(date_strs[0], date_strs[-1])
+    )
+    key_bearer_names = {e["name"] for e in employees if e.get("has_key")}
     
     weeks = []
-    
-    # Current week
-    current_week_dates = dates[:5]
-    current_week = {"label": "This Week", "days": []}
-    for d in current_week_dates:
-        d_str = d.isoformat()
-        absent = absence_map.get(d_str, set())
-        
-        # Check if all KEY BEARERS are absent
-        absent_key_bearers = absent & key_bearer_names
-        all_key_bearers_absent = len(key_bearer_names) > 0 and absent_key_bearers >= key_bearer_names
-        
-        day_data = {
-            "date": d_str,
-            "day_name": d.strftime("%a"),
-            "day_num": d.day,
-            "month": d.strftime("%b"),
-            "employees": [],
-            "all_key_bearers_absent": all_key_bearers_absent
-        }
-        for emp in employees:
-            day_data["employees"].append({
-                "name": emp["name"],
-                "has_key": emp.get("has_key", False),
-                "absent": emp["name"] in absent
-            })
-        current_week["days"].append(day_data)
-    weeks.append(current_week)
-    
-    # Next week
-    next_week_dates = dates[5:]
-    next_week = {"label": "Next Week", "days": []}
-    for d in next_week_dates:
-        d_str = d.isoformat()
-        absent = absence_map.get(d_str, set())
-        
-        absent_key_bearers = absent & key_bearer_names
-        all_key_bearers_absent = len(key_bearer_names) > 0 and absent_key_bearers >= key_bearer_names
-        
-        day_data = {
-            "date": d_str,
-            "day_name": d.strftime("%a"),
-            "day_num": d.day,
-            "month": d.strftime("%b"),
-            "employees": [],
-            "all_key_bearers_absent": all_key_bearers_absent
-        }
-        for emp in employees:
-            day_data["employees"].append({
-                "name": emp["name"],
-                "has_key": emp.get("has_key", False),
-                "absent": emp["name"] in absent
+    for label, week_dates in (("This Week", dates[:5]), ("Next Week", dates[5:])):
+        week = {"label": label, "days": []}
+        for d in week_dates:
+            d_str = d.isoformat()
+            absent = absence_map.get(d_str, set())
+            
+            # Check if all KEY BEARERS are absent
+            absent_key_bearers = absent & key_bearer_names
+            all_key_bearers_absent = len(key_bearer_names) > 0 and absent_key_bearers >= key_bearer_names
+            
+            week["days"].append({
+                "date": d_str,
+                "day_name": DAY_ABBRS[d.weekday()],
+                "day_num": d.day,
+                "month": MONTH_ABBRS[d.month],
+                # One character per entry in "employees" below: "1" if absent, "0" if not
+                "absent_mask": "".join("1" if emp["name"] in absent else "0" for emp in employees),
+                "all_key_bearers_absent": all_key_bearers_absent
             })
-        next_week["days"].append(day_data)
-    weeks.append(next_week)
+        weeks.append(week)
     
     return jsonify({"weeks": weeks, "employees": [{"name": e["name"], "has_key": e.get("has_key", False)} for e in employees]})
 
 @app.route("/api/status/<date_str>")
 def get_status(date_str):
     """Get status for a specific date."""
-    employees = get_all_employees()
-    key_bearers = get_key_bearers()
-    key_bearer_names = {kb["name"] for kb in key_bearers}
-    
-    result = supabase.table("absences").select("employee_name").eq("absence_date", date_str).execute()
-    absent_names = {row["employee_name"] for row in result.data}
+    employees, absence_map = run_in_parallel(
+        get_all_employees,
+        lambda: get_absences_in_range(date_str, date_str)
+    )
+    key_bearer_names = {e["name"] for e in employees if e.get("has_key")}
+    absent_names = absence_map.get(date_str, set())
     
     status = []
     for emp in employees:
@@ -670,8 +838,31 @@ def get_sydney_time():
 
 @app.route("/health")
 def health():
-    run_monthly_sync()
     return "OK", 200
 
+# Background scheduler for the daily monthly sync check
+scheduler = BackgroundScheduler(timezone=SYDNEY_TZ)
+
+def start_scheduler():
+    """Run the monthly sync now and then every day at 1am Sydney time."""
+    scheduler.add_job(
+        run_monthly_sync, "cron", hour=1,
+        id="monthly_sync", replace_existing=True, next_run_time=get_sydney_now(),
+        # Still run (once) if the 1am slot is missed while the process is busy
+        misfire_grace_time=3600, coalesce=True
+    )
+    scheduler.start()
+
+def start_background_jobs():
+    """Start the email worker and the scheduler. Only called from the process that serves
+    requests (gunicorn.conf.py, or below for the dev server), not whenever app is imported.
+    """
+    # Emails are sent from a background thread so requests don't wait on SMTP
+    start_email_worker()
+    start_scheduler()
+
 if __name__ == "__main__":
+    # With the reloader on, only the child process that serves requests runs the background jobs
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_jobs()
     app.run(debug=True, host="0.0.0.0", port=5000)
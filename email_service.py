@@ -1,105 +1,227 @@
+import os
+import queue
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime
+import threading
+from string import Template
+from email.message import EmailMessage
+from datetime import date
 
-def send_alert_email(config, alert_date, absent_bearers):
-    """Send alert email when all key bearers are absent."""
+# Email bodies, loaded once at import (see templates/email/)
+EMAIL_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "email")
+
+def load_email_template(filename):
+    """Read an email body template with $placeholders."""
+    with open(os.path.join(EMAIL_TEMPLATE_DIR, filename), encoding="utf-8") as f:
+        return Template(f.read())
+
+ALERT_TEXT_TEMPLATE = load_email_template("alert.txt")
+ALERT_HTML_TEMPLATE = load_email_template("alert.html")
+CHANGE_OF_PLANS_TEXT_TEMPLATE = load_email_template("change_of_plans.txt")
+CHANGE_OF_PLANS_HTML_TEMPLATE = load_email_template("change_of_plans.html")
+
+# Emails waiting to be sent by the background worker
+email_queue = queue.Queue()
+# A failed email is put back on the queue after EMAIL_RETRY_DELAY seconds, up to EMAIL_MAX_RETRIES times
+EMAIL_MAX_RETRIES = 3
+EMAIL_RETRY_DELAY = 30
+_worker_started = False
+_worker_lock = threading.Lock()
+
+class SMTPSession:
+    """An SMTP connection that is opened on first use and reused for later sends.
+    Before reusing the connection it's checked with NOOP, and reopened if the server dropped it.
+    """
+    
+    def __init__(self, email_config):
+        self.email_config = dict(email_config)
+        self.server = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def connect(self):
+        """Open and log in to the SMTP server."""
+        if self.email_config.get("use_tls", True):
+            server = smtplib.SMTP(self.email_config["smtp_host"], self.email_config["smtp_port"], timeout=30)
+            server.starttls()
+        else:
+            server = smtplib.SMTP_SSL(self.email_config["smtp_host"], self.email_config["smtp_port"], timeout=30)
+        
+        server.login(self.email_config["smtp_user"], self.email_config["smtp_password"])
+        self.server = server
+    
+    def is_alive(self):
+        """Check the open connection is still usable."""
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
     
+    def send(self, to_emails, msg):
+        """Send a message, (re)connecting first if needed."""
+        if self.server is not None and not self.is_alive():
+            self.close()
+        if self.server is None:
+            self.connect()
+        
+        # send_message writes the message with CRLF line endings, as SMTP requires
+        self.server.send_message(msg, from_addr=self.email_config["from_email"], to_addrs=to_emails)
+    
+    def close(self):
+        """Close the connection, ignoring errors if it's already dead."""
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except Exception:
+            pass
+        self.server = None
+
+def deliver_message(email_config, to_emails, msg, session=None):
+    """Send a message over the given session, or over a one-off connection if none is given."""
+    if session is not None:
+        session.send(to_emails, msg)
+        return
+    
+    with SMTPSession(email_config) as session:
+        session.send(to_emails, msg)
+
+def prepare_email_config(config):
+    """Work out the recipient list and From header once, when the config is loaded,
+    so each email can reuse them.
+    """
     email_config = config["email"]
-    recipients = config["recipients"]
+    config["_to_emails"] = [r["email"] for r in config["recipients"]]
+    config["_from_header"] = f"{email_config['from_name']} <{email_config['from_email']}>"
+    return config
+
+def get_addresses(config):
+    """Get (to_emails, from_header) for a config, using the values from prepare_email_config if present."""
+    if "_to_emails" in config:
+        return config["_to_emails"], config["_from_header"]
     
-    date_obj = datetime.strptime(alert_date, "%Y-%m-%d")
-    formatted_date = date_obj.strftime("%A, %B %d, %Y")
+    email_config = config["email"]
+    return [r["email"] for r in config["recipients"]], f"{email_config['from_name']} <{email_config['from_email']}>"
+
+def set_email_body(msg, email_config, text_content, html_content):
+    """Set the message body: plain text with an HTML alternative, or only the HTML
+    if "include_plain" is false in the email config.
+    EmailMessage picks the lightest transfer encoding for each part (7bit/quoted-printable for ASCII).
+    """
+    if email_config.get("include_plain", True):
+        msg.set_content(text_content)
+        msg.add_alternative(html_content, subtype="html")
+    else:
+        msg.set_content(html_content, subtype="html")
+
+def queue_email(send_func, config, alert_date, payload, on_failure=None):
+    """Queue an email to be sent by the background worker.
+    send_func is send_alert_email or send_change_of_plans_email, payload is its third argument.
+    on_failure(alert_date) is called from the worker thread if the email still could not be sent after retrying.
+    """
+    start_email_worker()
+    email_queue.put((send_func, config, alert_date, payload, on_failure, 0))
+
+def _retry_later(send_func, config, alert_date, payload, on_failure, retries):
+    """Put a failed email back on the queue after EMAIL_RETRY_DELAY seconds."""
+    timer = threading.Timer(
+        EMAIL_RETRY_DELAY,
+        email_queue.put,
+        args=((send_func, config, alert_date, payload, on_failure, retries + 1),)
+    )
+    timer.daemon = True
+    timer.start()
+
+def start_email_worker():
+    """Start the background email worker thread (once per process)."""
+    global _worker_started
+    with _worker_lock:
+        if _worker_started:
+            return
+        threading.Thread(target=_email_worker, name="email-worker", daemon=True).start()
+        _worker_started = True
+
+def _email_worker():
+    """Send queued emails, reusing one SMTP session for as long as the settings don't change."""
+    session = None
     
-    to_emails = [r["email"] for r in recipients]
+    while True:
+        send_func, config, alert_date, payload, on_failure, retries = email_queue.get()
+        try:
+            session = _send_queued_email(session, send_func, config, alert_date, payload, on_failure, retries)
+        except Exception as e:
+            # A bad job (e.g. malformed date or config) mustn't kill the worker thread
+            print(f"Email worker error for {alert_date}: {e}")
+            if session is not None:
+                session.close()
+            _call_failure_handler(on_failure, alert_date)
+        finally:
+            email_queue.task_done()
+
+def _send_queued_email(session, send_func, config, alert_date, payload, on_failure, retries):
+    """Send one queued email, retrying later or calling on_failure if it fails. Returns the session to reuse."""
+    email_config = config["email"]
+    
+    # Start a new session if the email settings changed since it was opened
+    if session is not None and session.email_config != email_config:
+        session.close()
+        session = None
+    if session is None:
+        session = SMTPSession(email_config)
+    
+    success = send_func(config, alert_date, payload, session=session)
+    if not success:
+        # Don't reuse a connection that just failed
+        session.close()
+    
+    if not success and retries < EMAIL_MAX_RETRIES:
+        print(f"Retrying email for {alert_date} in {EMAIL_RETRY_DELAY}s (retry {retries + 1} of {EMAIL_MAX_RETRIES})")
+        _retry_later(send_func, config, alert_date, payload, on_failure, retries)
+    elif not success:
+        _call_failure_handler(on_failure, alert_date)
+    
+    return session
+
+def _call_failure_handler(on_failure, alert_date):
+    """Call the on_failure callback of an email that could not be sent, if it has one."""
+    if on_failure is None:
+        return
+    try:
+        on_failure(alert_date)
+    except Exception as e:
+        print(f"Email failure handler error: {e}")
+
+def send_alert_email(config, alert_date, absent_bearers, session=None):
+    """Send alert email when all key bearers are absent.
+    Uses the given SMTPSession if provided, otherwise opens a new connection.
+    """
+    
+    email_config = config["email"]
+    to_emails, from_header = get_addresses(config)
     
-    msg = MIMEMultipart("alternative")
+    formatted_date = date.fromisoformat(alert_date).strftime("%A, %B %d, %Y")
+    
+    msg = EmailMessage()
     msg["Subject"] = f"Park Agility Office Alert - No Key Bearers Available - {formatted_date}"
-    msg["From"] = f"{email_config['from_name']} <{email_config['from_email']}>"
+    msg["From"] = from_header
     msg["To"] = ", ".join(to_emails)
     msg["X-Priority"] = "1"
     msg["X-MSMail-Priority"] = "High"
     msg["Importance"] = "High"
     
-    text_content = f"""
-PARK AGILITY - OFFICE ACCESS ALERT
-
-Date: {formatted_date}
-
-All key bearers have indicated they will NOT be in the office on this date.
-
-Key Bearers Status:
-{chr(10).join([f"  - {kb['name']}: Not Available" for kb in absent_bearers])}
-
-Please make alternative arrangements if you need office access on this day.
-
----
-This is an automated message from the Park Agility Office Presence Tracker. Please do not reply to this email. The inbox is not monitored.
-"""
-    
-    html_content = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; line-height: 1.6; color: #333; }}
-        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-        .header {{ background: #1e2a5e; color: white; padding: 30px; border-radius: 12px 12px 0 0; text-align: center; }}
-        .header h1 {{ margin: 0; font-size: 24px; }}
-        .tagline {{ color: #3dbb91; font-size: 12px; letter-spacing: 1px; margin-top: 8px; }}
-        .content {{ background: #f8f9fa; padding: 30px; border-radius: 0 0 12px 12px; }}
-        .date-box {{ background: white; padding: 20px; border-radius: 8px; text-align: center; margin-bottom: 20px; border-left: 4px solid #dc2626; }}
-        .date-box h2 {{ margin: 0; color: #dc2626; font-size: 20px; }}
-        .status-list {{ background: white; padding: 20px; border-radius: 8px; }}
-        .status-item {{ padding: 10px 0; border-bottom: 1px solid #eee; }}
-        .status-item:last-child {{ border-bottom: none; }}
-        .footer {{ text-align: center; margin-top: 20px; color: #888; font-size: 12px; }}
-        .warning-box {{ margin-top: 20px; padding: 15px; background: #fef3e6; border-radius: 8px; color: #b45309; border: 1px solid #fcd9b6; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>Park Agility Office Presence Tracker</h1>
-            <div class="tagline">FASTER.SMARTER.GREENER.</div>
-        </div>
-        <div class="content">
-            <div class="date-box">
-                <h2>{formatted_date}</h2>
-                <p style="margin: 10px 0 0 0; color: #666;">No key bearers available</p>
-            </div>
-            <p><strong>All key bearers</strong> have indicated they will NOT be in the office on this date.</p>
-            <div class="status-list">
-                <h3 style="margin-top: 0; color: #1e2a5e;">Key Bearers Status:</h3>
-                {''.join([f'<div class="status-item">{kb["name"]} - Not Available</div>' for kb in absent_bearers])}
-            </div>
-            <div class="warning-box">
-                Please make alternative arrangements if you need office access on this day.
-            </div>
-        </div>
-        <div class="footer">
-            This is an automated message from the Park Agility Office Presence Tracker. Please do not reply to this email. The inbox is not monitored.
-        </div>
-    </div>
-</body>
-</html>
-"""
-    
-    msg.attach(MIMEText(text_content, "plain", "utf-8"))
-    msg.attach(MIMEText(html_content, "html", "utf-8"))
+    bearer_lines = "\n".join(f"  - {kb['name']}: Not Available" for kb in absent_bearers)
+    bearer_rows = "".join(f'<div class="status-item">{kb["name"]} - Not Available</div>' for kb in absent_bearers)
+    
+    text_content = ALERT_TEXT_TEMPLATE.substitute(formatted_date=formatted_date, bearer_lines=bearer_lines)
+    html_content = ALERT_HTML_TEMPLATE.substitute(formatted_date=formatted_date, bearer_rows=bearer_rows)
+    
+    set_email_body(msg, email_config, text_content, html_content)
     
     try:
-        if email_config.get("use_tls", True):
-            server = smtplib.SMTP(email_config["smtp_host"], email_config["smtp_port"], timeout=30)
-            server.starttls()
-        else:
-            server = smtplib.SMTP_SSL(email_config["smtp_host"], email_config["smtp_port"], timeout=30)
-        
-        server.login(email_config["smtp_user"], email_config["smtp_password"])
-        server.sendmail(email_config["from_email"], to_emails, msg.as_string())
-        server.quit()
+        deliver_message(email_config, to_emails, msg, session)
         
         print(f"Alert email sent for {alert_date} to {len(to_emails)} recipients")
         return True
@@ -115,96 +237,31 @@ This is an automated message from the Park Agility Office Presence Tracker. Plea
         return False
 
 
-def send_change_of_plans_email(config, alert_date, employee_name):
-    """Send email when someone becomes available after all-absent alert was sent."""
+def send_change_of_plans_email(config, alert_date, employee_name, session=None):
+    """Send email when someone becomes available after all-absent alert was sent.
+    Uses the given SMTPSession if provided, otherwise opens a new connection.
+    """
     
     email_config = config["email"]
-    recipients = config["recipients"]
+    to_emails, from_header = get_addresses(config)
     
-    date_obj = datetime.strptime(alert_date, "%Y-%m-%d")
-    formatted_date = date_obj.strftime("%A, %B %d, %Y")
+    formatted_date = date.fromisoformat(alert_date).strftime("%A, %B %d, %Y")
     
-    to_emails = [r["email"] for r in recipients]
-    
-    msg = MIMEMultipart("alternative")
+    msg = EmailMessage()
     msg["Subject"] = f"Park Agility Office Update - Change of Plans - {formatted_date}"
-    msg["From"] = f"{email_config['from_name']} <{email_config['from_email']}>"
+    msg["From"] = from_header
     msg["To"] = ", ".join(to_emails)
     msg["X-Priority"] = "1"
     msg["X-MSMail-Priority"] = "High"
     msg["Importance"] = "High"
     
-    text_content = f"""
-PARK AGILITY - CHANGE OF PLANS
-
-Date: {formatted_date}
-
-Good news! {employee_name} is now going to be in the office on this date.
-
-The office will be accessible.
-
----
-This is an automated message from the Park Agility Office Presence Tracker. Please do not reply to this email. The inbox is not monitored.
-"""
-    
-    html_content = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <style>
-        body {{ font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; line-height: 1.6; color: #333; }}
-        .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
-        .header {{ background: #1e2a5e; color: white; padding: 30px; border-radius: 12px 12px 0 0; text-align: center; }}
-        .header h1 {{ margin: 0; font-size: 24px; }}
-        .tagline {{ color: #3dbb91; font-size: 12px; letter-spacing: 1px; margin-top: 8px; }}
-        .content {{ background: #f8f9fa; padding: 30px; border-radius: 0 0 12px 12px; }}
-        .date-box {{ background: white; padding: 20px; border-radius: 8px; text-align: center; margin-bottom: 20px; border-left: 4px solid #3dbb91; }}
-        .date-box h2 {{ margin: 0; color: #3dbb91; font-size: 20px; }}
-        .good-news {{ background: #d4f5e9; padding: 20px; border-radius: 8px; text-align: center; margin: 20px 0; }}
-        .good-news h3 {{ margin: 0 0 10px 0; color: #1a7a5a; }}
-        .good-news p {{ margin: 0; color: #166534; font-size: 16px; }}
-        .footer {{ text-align: center; margin-top: 20px; color: #888; font-size: 12px; }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>Park Agility Office Presence Tracker</h1>
-            <div class="tagline">FASTER.SMARTER.GREENER.</div>
-        </div>
-        <div class="content">
-            <div class="date-box">
-                <h2>{formatted_date}</h2>
-                <p style="margin: 10px 0 0 0; color: #666;">Change of Plans</p>
-            </div>
-            <div class="good-news">
-                <h3>Good News!</h3>
-                <p><strong>{employee_name}</strong> is now going to be in the office on this date.</p>
-            </div>
-            <p style="text-align: center; color: #666;">The office will be accessible.</p>
-        </div>
-        <div class="footer">
-            This is an automated message from the Park Agility Office Presence Tracker. Please do not reply to this email. The inbox is not monitored.
-        </div>
-    </div>
-</body>
-</html>
-"""
-    
-    msg.attach(MIMEText(text_content, "plain", "utf-8"))
-    msg.attach(MIMEText(html_content, "html", "utf-8"))
+    text_content = CHANGE_OF_PLANS_TEXT_TEMPLATE.substitute(formatted_date=formatted_date, employee_name=employee_name)
+    html_content = CHANGE_OF_PLANS_HTML_TEMPLATE.substitute(formatted_date=formatted_date, employee_name=employee_name)
+    
+    set_email_body(msg, email_config, text_content, html_content)
     
     try:
-        if email_config.get("use_tls", True):
-            server = smtplib.SMTP(email_config["smtp_host"], email_config["smtp_port"], timeout=30)
-            server.starttls()
-        else:
-            server = smtplib.SMTP_SSL(email_config["smtp_host"], email_config["smtp_port"], timeout=30)
-        
-        server.login(email_config["smtp_user"], email_config["smtp_password"])
-        server.sendmail(email_config["from_email"], to_emails, msg.as_string())
-        server.quit()
+        deliver_message(email_config, to_emails, msg, session)
         
         print(f"Change of plans email sent for {alert_date} - {employee_name} now available")
         return True
@@ -0,0 +1,6 @@
+# Loaded by gunicorn (see Procfile / render.yaml)
+
+def post_worker_init(worker):
+    """Start the email worker and scheduler in the worker process that serves requests."""
+    from app import start_background_jobs
+    start_background_jobs()
@@ -49,11 +49,18 @@ CREATE TABLE IF NOT EXISTS sync_log (
 );
 
 -- 6. Create indexes for better query performance
+--    The UNIQUE constraints above already index absences(employee_name, absence_date),
+--    email_log(alert_date), usual_absences(employee_name) and sync_log(sync_key).
+--    (absence_date, employee_name) lets date lookups (eq / in / range) be answered from the index alone.
+--    Check with: EXPLAIN ANALYZE SELECT employee_name FROM absences WHERE absence_date >= CURRENT_DATE;
 CREATE INDEX IF NOT EXISTS idx_employees_has_key ON employees(has_key);
-CREATE INDEX IF NOT EXISTS idx_absences_date ON absences(absence_date);
-CREATE INDEX IF NOT EXISTS idx_absences_employee ON absences(employee_name);
-CREATE INDEX IF NOT EXISTS idx_email_log_date ON email_log(alert_date);
-CREATE INDEX IF NOT EXISTS idx_usual_absences_employee ON usual_absences(employee_name);
+CREATE INDEX IF NOT EXISTS idx_absences_date_employee ON absences(absence_date, employee_name);
+
+-- Superseded by the indexes above (safe to re-run on an existing database)
+DROP INDEX IF EXISTS idx_absences_date;
+DROP INDEX IF EXISTS idx_absences_employee;
+DROP INDEX IF EXISTS idx_email_log_date;
+DROP INDEX IF EXISTS idx_usual_absences_employee;
 
 -- 7. Enable Row Level Security (RLS) with permissive policies
 ALTER TABLE employees ENABLE ROW LEVEL SECURITY;
@@ -69,6 +76,63 @@ CREATE POLICY "Allow all on email_log" ON email_log FOR ALL USING (true) WITH CH
 CREATE POLICY "Allow all on usual_absences" ON usual_absences FOR ALL USING (true) WITH CHECK (true);
 CREATE POLICY "Allow all on sync_log" ON sync_log FOR ALL USING (true) WITH CHECK (true);
 
+-- 8. Absences grouped by date (used by the status endpoints and absences_calendar below)
+--    to_date is optional - leave it out to get everything from from_date onwards
+CREATE OR REPLACE FUNCTION absences_by_date(from_date DATE, to_date DATE DEFAULT NULL)
+RETURNS TABLE (absence_date DATE, employee_names TEXT[])
+LANGUAGE sql STABLE
+AS $$
+    SELECT a.absence_date, array_agg(a.employee_name ORDER BY a.employee_name)
+    FROM absences a
+    WHERE a.absence_date >= from_date
+      AND (to_date IS NULL OR a.absence_date <= to_date)
+    GROUP BY a.absence_date
+    ORDER BY a.absence_date;
+$$;
+
+-- 9. The same grouping as a single JSON object {"YYYY-MM-DD": [names...]} (used by the calendar)
+CREATE OR REPLACE FUNCTION absences_calendar(from_date DATE)
+RETURNS JSONB
+LANGUAGE sql STABLE
+AS $$
+    SELECT COALESCE(jsonb_object_agg(d.absence_date, to_jsonb(d.employee_names)), '{}'::jsonb)
+    FROM absences_by_date(from_date) d;
+$$;
+
+-- 10. Alert check for a batch of dates (used when absences are added)
+--     Returns the current key bearers and the dates that need an alert: every key bearer
+--     is absent and there's no alert already waiting for a follow-up.
+CREATE OR REPLACE FUNCTION check_alert_state(dates DATE[])
+RETURNS JSONB
+LANGUAGE sql STABLE
+AS $$
+    WITH kb AS (
+        SELECT name FROM employees WHERE has_key
+    ),
+    candidates AS (
+        SELECT DISTINCT d.alert_date FROM unnest(dates) AS d(alert_date)
+    )
+    SELECT jsonb_build_object(
+        'key_bearers', COALESCE((SELECT jsonb_agg(jsonb_build_object('name', kb.name) ORDER BY kb.name) FROM kb), '[]'::jsonb),
+        'alert_dates', COALESCE((
+            SELECT jsonb_agg(c.alert_date ORDER BY c.alert_date)
+            FROM candidates c
+            WHERE EXISTS (SELECT 1 FROM kb)
+              AND NOT EXISTS (
+                  SELECT 1 FROM email_log e
+                  WHERE e.alert_date = c.alert_date AND NOT COALESCE(e.followup_sent, FALSE)
+              )
+              AND NOT EXISTS (
+                  SELECT 1 FROM kb
+                  WHERE NOT EXISTS (
+                      SELECT 1 FROM absences a
+                      WHERE a.absence_date = c.alert_date AND a.employee_name = kb.name
+                  )
+              )
+        ), '[]'::jsonb)
+    );
+$$;
+
 -- =============================================
 -- SAMPLE DATA: Add your employees here
 -- =============================================